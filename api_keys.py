@@ -10,21 +10,22 @@ Endpoints:
 2. GET /api/keys/status - статус подключения
 3. POST /api/keys/test - протестировать ключи (JSON body)
 4. DELETE /api/keys - удалить ключи
-5. OPTIONS /api/keys/* - CORS preflight
 """
 
-from fastapi import APIRouter, HTTPException, Depends, Request
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 from typing import Dict
 from pydantic import BaseModel
 from datetime import datetime
 
-from database import get_db
+from database import get_async_db
 from models import ExchangeAPI
 from utils.crypto import get_encryption_manager
-from bybit_service import get_bybit_client, reset_bybit_client
+from bybit_service import get_bybit_client, reset_bybit_client, clear_credentials_cache
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/keys", tags=["API Keys"])
@@ -50,32 +51,12 @@ class RemoveKeyRequest(BaseModel):
     exchange: str = "bybit"
 
 
-# ===================== CORS PREFLIGHT =====================
-
-@router.options("/add")
-@router.options("/status")
-@router.options("/test")
-@router.options("/remove")
-async def options_handler(request: Request) -> JSONResponse:
-    """Обработка CORS preflight OPTIONS запросов"""
-    return JSONResponse(
-        content={},
-        status_code=200,
-        headers={
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET, POST, DELETE, OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type, Authorization",
-            "Access-Control-Max-Age": "3600",
-        }
-    )
-
-
 # ===================== ENDPOINTS =====================
 
 @router.post("/add")
 async def add_api_keys(
     request: AddKeyRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> Dict:
     """Добавить API ключи для биржи"""
     try:
@@ -100,8 +81,10 @@ async def add_api_keys(
         # Проверяем что ключи валидны
         try:
             bybit_client = get_bybit_client(request.api_key, request.api_secret, request.testnet)
-            if not bybit_client.validate_credentials():
-                reset_bybit_client()
+            if not await bybit_client.validate_credentials():
+                # Только пул клиентов: отрицательный результат проверки
+                # остаётся в кэше, повторный /add не идёт в Bybit
+                reset_bybit_client(request.api_key, clear_validation=False)
                 raise HTTPException(
                     status_code=401,
                     detail="API ключи невалидны или нет доступа"
@@ -113,28 +96,35 @@ async def add_api_keys(
                 detail=f"Ошибка подключения: {str(e)}"
             )
         
-        # Удаляем старые ключи если существуют
-        existing = db.query(ExchangeAPI).filter(
-            ExchangeAPI.exchange == request.exchange.lower()
-        ).first()
-        
-        if existing:
-            db.delete(existing)
-            logger.info(f"Removed old API keys for {request.exchange}")
-        
-        # Создаём новую запись
-        new_exchange_api = ExchangeAPI(
+        # Создаём или обновляем запись одним INSERT ... ON CONFLICT (exchange) DO UPDATE
+        now = datetime.utcnow()
+        insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+        stmt = insert(ExchangeAPI).values(
             exchange=request.exchange.lower(),
             api_key_encrypted=encrypted_key,
             api_secret_encrypted=encrypted_secret,
             testnet=request.testnet,
             is_connected=True,
-            last_connection_check=datetime.utcnow(),
+            last_connection_check=now,
         )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ExchangeAPI.exchange],
+            set_={
+                "api_key_encrypted": stmt.excluded.api_key_encrypted,
+                "api_secret_encrypted": stmt.excluded.api_secret_encrypted,
+                "testnet": stmt.excluded.testnet,
+                "is_connected": True,
+                "last_connection_check": now,
+                "connection_error": None,
+                "updated_at": now,
+            },
+        ).returning(ExchangeAPI.id)
+        
+        exchange_id = (await db.execute(stmt)).scalar_one()
+        await db.commit()
         
-        db.add(new_exchange_api)
-        db.commit()
-        db.refresh(new_exchange_api)
+        # Ключи изменились - сбрасываем расшифрованные
+        clear_credentials_cache(exchange_id)
         
         logger.info(f"✅ API keys added for {request.exchange} (testnet={request.testnet})")
         
@@ -143,7 +133,7 @@ async def add_api_keys(
             "message": f"API ключи для {request.exchange} успешно добавлены",
             "exchange": request.exchange,
             "testnet": request.testnet,
-            "exchange_id": new_exchange_api.id,
+            "exchange_id": exchange_id,
         }
     
     except HTTPException:
@@ -157,10 +147,19 @@ async def add_api_keys(
 
 
 @router.get("/status")
-async def get_keys_status(db: Session = Depends(get_db)) -> Dict:
+async def get_keys_status(db: AsyncSession = Depends(get_async_db)) -> Dict:
     """Получить статус подключения к биржам"""
     try:
-        exchanges = db.query(ExchangeAPI).all()
+        exchanges = (await db.execute(
+            select(
+                ExchangeAPI.exchange,
+                ExchangeAPI.is_connected,
+                ExchangeAPI.testnet,
+                ExchangeAPI.total_positions,
+                ExchangeAPI.closed_positions,
+                ExchangeAPI.last_connection_check,
+            )
+        )).all()
         
         statuses = []
         for exchange in exchanges:
@@ -199,8 +198,7 @@ async def test_api_keys(request: TestKeyRequest) -> Dict:
         
         # Пытаемся подключиться
         bybit_client = get_bybit_client(request.api_key, request.api_secret, request.testnet)
-        is_valid = bybit_client.validate_credentials()
-        reset_bybit_client()
+        is_valid = await bybit_client.validate_credentials()
         
         if is_valid:
             return {
@@ -227,13 +225,13 @@ async def test_api_keys(request: TestKeyRequest) -> Dict:
 @router.delete("/remove")
 async def remove_api_keys(
     request: RemoveKeyRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> Dict:
     """Удалить API ключи"""
     try:
-        exchange_api = db.query(ExchangeAPI).filter(
-            ExchangeAPI.exchange == request.exchange.lower()
-        ).first()
+        exchange_api = (await db.execute(
+            select(ExchangeAPI).where(ExchangeAPI.exchange == request.exchange.lower())
+        )).scalar_one_or_none()
         
         if not exchange_api:
             raise HTTPException(
@@ -241,11 +239,13 @@ async def remove_api_keys(
                 detail=f"API ключи для {request.exchange} не найдены"
             )
         
-        db.delete(exchange_api)
-        db.commit()
+        await db.delete(exchange_api)
+        await db.commit()
         
-        # Сбрасываем клиент
+        # Сбрасываем клиент и расшифрованные ключи
         reset_bybit_client()
+        clear_credentials_cache(exchange_api.id)
+        get_encryption_manager().clear_cache()
         
         logger.info(f"✅ API keys removed for {request.exchange}")
         
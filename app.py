@@ -15,22 +15,32 @@ app.py - Главное FastAPI приложение (PHASE 4 - FINAL v1.6)
 
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import ORJSONResponse, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from anyio import to_thread
+import asyncio
 import logging
+import orjson
+import os
+import sys
+import time
 import uvicorn
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import lru_cache
 from typing import Dict, List
 
 # Импорты проекта
 from config import get_settings
-from database import init_db, get_db, SessionLocal, engine
-from models import Base, ExchangeAPI
+from database import init_db, close_db, get_async_db
+from models import Base, CREDENTIAL_COLUMNS, ExchangeAPI
 import api_keys
 import orders
 import positions
 import trades
 import events
+import bybit_service
+from utils.crypto import init_encryption_manager, log_crypto_backend
 
 # ==================== КОНФИГУРАЦИЯ ====================
 
@@ -50,18 +60,7 @@ app = FastAPI(
     version="0.1.0",
     docs_url="/docs",
     openapi_url="/openapi.json",
-)
-
-# ==================== CORS MIDDLEWARE ====================
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-    expose_headers=["*"],
-    max_age=3600,
+    default_response_class=ORJSONResponse,
 )
 
 # ==================== СОБЫТИЯ ПРИЛОЖЕНИЯ ====================
@@ -74,8 +73,18 @@ async def startup_event():
     logger.info(f"🔧 Debug mode: {settings.DEBUG}")
     logger.info(f"💾 Database: {settings.DATABASE_URL}")
     
+    # Директория для логов
+    if settings.LOG_DIR:
+        os.makedirs(settings.LOG_DIR, exist_ok=True)
+    
+    # sync endpoints (trades, events) выполняются в threadpool anyio
+    to_thread.current_default_thread_limiter().total_tokens = settings.THREADPOOL_SIZE
+    
     init_db()
     logger.info("✅ Database initialized successfully")
+    log_crypto_backend()
+    init_encryption_manager(os.getenv("ENCRYPTION_KEY"))
+    await bybit_service.init_http_session()
     logger.info("🎉 Application ready for WebSocket connections!")
 
 
@@ -83,6 +92,8 @@ async def startup_event():
 async def shutdown_event():
     """Очистка при завершении"""
     logger.info("🛑 Shutting down...")
+    await bybit_service.close_http_session()
+    await close_db()
 
 
 # ==================== MIDDLEWARE ЛОГИРОВАНИЯ ====================
@@ -90,15 +101,18 @@ async def shutdown_event():
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     """Логирование всех HTTP запросов"""
-    start_time = datetime.utcnow()
+    if request.method == "OPTIONS":
+        return await call_next(request)
+    
+    start_time = time.perf_counter()
     
     try:
         response = await call_next(request)
-        process_time = (datetime.utcnow() - start_time).total_seconds()
+        process_time = time.perf_counter() - start_time
         
         status_emoji = "🟢" if response.status_code < 400 else "🔴"
         logger.info(
-            f"{status_emoji} {request.method} {request.url.path} - {response.status_code} - {process_time:.3f}s"
+            f"{status_emoji} {request.method} {request.url.path} - {response.status_code} - {process_time * 1000:.1f}ms"
         )
         
         return response
@@ -107,46 +121,78 @@ async def log_requests(request: Request, call_next):
         raise
 
 
+# ==================== CORS MIDDLEWARE ====================
+
+# Регистрируется последним => внешний middleware: CORS preflight
+# отвечается сразу, не доходя до логирования и роутинга
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["*"],
+    max_age=3600,
+)
+
 # ==================== HEALTH ENDPOINTS ====================
 
-@app.get("/health")
-async def health_check() -> Dict:
-    """Проверка здоровья приложения"""
-    return {
+# Ответы собираются из неизменяемых настроек - сериализуем заранее
+_APP_INFO = orjson.dumps({
+    "status": "success",
+    "app": "Slezun Web Dashboard",
+    "version": app.version,
+    "phase": "4",
+    "environment": settings.ENVIRONMENT,
+    "debug": settings.DEBUG,
+    "database": settings.DATABASE_URL,
+})
+
+
+@lru_cache(maxsize=2)
+def _now_iso(second: int) -> str:
+    """UTC время в ISO формате с точностью до секунды (кэш на текущую секунду)"""
+    return datetime.fromtimestamp(second, timezone.utc).replace(tzinfo=None).isoformat()
+
+
+@lru_cache(maxsize=1)
+def _health_payload(second: int) -> bytes:
+    """Тело ответа /health (меняется только timestamp, раз в секунду)"""
+    return orjson.dumps({
         "status": "ok",
         "app": "Slezun Web Dashboard",
         "version": app.version,
         "phase": "4",
-        "timestamp": datetime.utcnow().isoformat(),
-    }
+        "timestamp": _now_iso(second),
+    })
+
+
+@app.get("/health")
+async def health_check() -> Response:
+    """Проверка здоровья приложения"""
+    return Response(_health_payload(int(time.time())), media_type="application/json")
 
 
 @app.get("/api/info")
-async def get_app_info() -> Dict:
+async def get_app_info() -> Response:
     """Получить информацию о приложении"""
-    return {
-        "status": "success",
-        "app": "Slezun Web Dashboard",
-        "version": app.version,
-        "phase": "4",
-        "environment": settings.ENVIRONMENT,
-        "debug": settings.DEBUG,
-        "database": settings.DATABASE_URL,
-    }
+    return Response(_APP_INFO, media_type="application/json")
 
 
 @app.get("/api/status")
-async def get_system_status(db: Session = Depends(get_db)) -> Dict:
+async def get_system_status(db: AsyncSession = Depends(get_async_db)) -> Dict:
     """Получить полный статус системы"""
     try:
-        exchanges = db.query(ExchangeAPI).all()
+        exchanges = (await db.execute(
+            select(ExchangeAPI.exchange, ExchangeAPI.is_connected, ExchangeAPI.testnet)
+        )).all()
         
         return {
             "status": "success",
             "system": {
                 "app": "Slezun Web Dashboard",
                 "version": app.version,
-                "uptime": datetime.utcnow().isoformat(),
+                "uptime": _now_iso(int(time.time())),
             },
             "database": {
                 "connected": True,
@@ -172,17 +218,18 @@ async def get_system_status(db: Session = Depends(get_db)) -> Dict:
 
 
 @app.get("/api/account")
-async def get_account_info(db: Session = Depends(get_db)) -> Dict:
+async def get_account_info(db: AsyncSession = Depends(get_async_db)) -> Dict:
     """Получить информацию об аккаунте Bybit"""
     try:
-        from bybit_service import get_bybit_client
-        from utils.crypto import get_encryption_manager
+        from bybit_service import get_bybit_client, get_credentials, has_credentials
         
-        exchange = db.query(ExchangeAPI).filter(
-            ExchangeAPI.exchange == "bybit"
-        ).first()
+        exchange = (await db.execute(
+            select(*CREDENTIAL_COLUMNS).where(ExchangeAPI.exchange == "bybit")
+        )).one_or_none()
+        # Соединение возвращается в пул до запроса к Bybit, а не после ответа
+        await db.close()
         
-        if not exchange:
+        if not has_credentials(exchange):
             return {
                 "status": "error",
                 "message": "API ключи не добавлены",
@@ -194,12 +241,11 @@ async def get_account_info(db: Session = Depends(get_db)) -> Dict:
             }
         
         try:
-            encryptor = get_encryption_manager()
-            api_key = encryptor.decrypt(exchange.api_key_encrypted)
-            api_secret = encryptor.decrypt(exchange.api_secret_encrypted)
+            api_key, api_secret = get_credentials(exchange)
             
             client = get_bybit_client(api_key, api_secret, exchange.testnet)
-            account_info = client.get_account_info()
+            snapshot = await client.get_snapshot()
+            account_info = snapshot["account"]
             
             return {
                 "status": "success",
@@ -207,6 +253,7 @@ async def get_account_info(db: Session = Depends(get_db)) -> Dict:
                 "equity": float(account_info.get("total_equity", 0)),
                 "available_balance": float(account_info.get("available_balance", 0)),
                 "unrealized_pnl": float(account_info.get("total_unrealised_loss", 0)),
+                "open_positions": sum(1 for p in snapshot["positions"] if float(p.get("size", 0)) > 0),
                 "account_type": "TESTNET" if exchange.testnet else "LIVE",
             }
             
@@ -235,23 +282,6 @@ async def get_account_info(db: Session = Depends(get_db)) -> Dict:
         }
 
 
-# ==================== OPTIONS HANDLER ====================
-
-@app.options("/{full_path:path}")
-async def options_handler(full_path: str) -> JSONResponse:
-    """Универсальный обработчик OPTIONS запросов для CORS preflight"""
-    return JSONResponse(
-        content={},
-        status_code=200,
-        headers={
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS, PATCH",
-            "Access-Control-Allow-Headers": "Content-Type, Authorization",
-            "Access-Control-Max-Age": "3600",
-        }
-    )
-
-
 # ==================== РЕГИСТРАЦИЯ ROUTES ====================
 
 app.include_router(api_keys.router)
@@ -275,15 +305,32 @@ class ConnectionManager:
         logger.info(f"✅ WebSocket connected. Total: {len(self.active_connections)}")
     
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
-        logger.info(f"❌ WebSocket disconnected. Total: {len(self.active_connections)}")
+        # Соединение могло быть уже удалено в broadcast
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+            logger.info(f"❌ WebSocket disconnected. Total: {len(self.active_connections)}")
     
     async def broadcast(self, data: Dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(data)
-            except Exception as e:
-                logger.error(f"Error broadcasting: {e}")
+        """
+        Разослать данные всем клиентам
+        
+        JSON сериализуется один раз, отправка идёт параллельно - медленный
+        клиент не задерживает остальных. Соединения с ошибкой отправки удаляются
+        """
+        if not self.active_connections:
+            return
+        
+        message = orjson.dumps(data).decode()
+        connections = list(self.active_connections)
+        results = await asyncio.gather(
+            *(connection.send_text(message) for connection in connections),
+            return_exceptions=True,
+        )
+        
+        for connection, result in zip(connections, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error broadcasting: {result}")
+                self.disconnect(connection)
 
 
 manager = ConnectionManager()
@@ -299,10 +346,10 @@ async def websocket_endpoint(websocket: WebSocket):
             logger.info(f"WebSocket received: {data}")
             
             if data == "ping":
-                await websocket.send_json({
+                await websocket.send_text(orjson.dumps({
                     "type": "pong",
-                    "timestamp": datetime.utcnow().isoformat()
-                })
+                    "timestamp": _now_iso(int(time.time()))
+                }).decode())
     except WebSocketDisconnect:
         manager.disconnect(websocket)
         logger.info("WebSocket client disconnected")
@@ -316,7 +363,7 @@ async def websocket_endpoint(websocket: WebSocket):
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     """Обработка HTTP исключений"""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={
             "status": "error",
@@ -330,7 +377,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
 async def general_exception_handler(request: Request, exc: Exception):
     """Обработка общих исключений"""
     logger.error(f"Unhandled exception: {exc}", exc_info=True)
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "status": "error",
@@ -343,10 +390,15 @@ async def general_exception_handler(request: Request, exc: Exception):
 # ==================== ГЛАВНАЯ ТОЧКА ВХОДА ====================
 
 if __name__ == "__main__":
+    reload = settings.RELOAD and settings.DEBUG
     uvicorn.run(
         "app:app",
-        host="0.0.0.0",
-        port=5000,
-        reload=True,
+        host=settings.HOST,
+        port=settings.PORT,
+        reload=reload,
+        # uvloop не поддерживается на Windows
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        workers=1 if reload else settings.WORKERS,
         log_level="info",
     )
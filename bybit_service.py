@@ -10,17 +10,148 @@ bybit_service.py - Сервис для работы с Bybit API (ИСПРАВЛ
 2. get_account_info() - баланс, equity, available balance
 3. get_positions() - открытые позиции
 4. validate_credentials() - проверка ключей
+5. get_snapshot() - баланс + позиции одним параллельным запросом
+6. init_http_session() / close_http_session() - общая aiohttp сессия
+7. get_credentials() - расшифрованные ключи ExchangeAPI (с кэшем)
+8. has_credentials() - есть ли у ExchangeAPI непустые ключи
 """
 
-from pybit.unified_trading import HTTP
+import aiohttp
+import asyncio
+import hashlib
+import hmac
 import logging
-from typing import Dict, Optional
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlencode
+from yarl import URL
+
+from config import get_settings
+from utils.crypto import get_encryption_manager
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Общая HTTP сессия (пул keep-alive соединений к api.bybit.com)
+_http_session: Optional[aiohttp.ClientSession] = None
+_HTTP_TIMEOUT = 10  # секунды
+_HTTP_LIMIT_PER_HOST = 64
+
+# Пул клиентов: (_key_id(api_key), testnet) -> BybitClientWrapper (LRU, последний - самый свежий)
+_CLIENTS: "OrderedDict[Tuple[str, bool], BybitClientWrapper]" = OrderedDict()
+_MAX_CLIENTS = 8
+_clients_lock = threading.Lock()
+
+# Кэш результатов validate_credentials (LRU, последний - самый свежий):
+# (_key_id(api_key), _key_id(api_secret), testnet) -> (is_valid, expires_at)
+_VALIDATION_CACHE: "OrderedDict[Tuple[str, str, bool], Tuple[bool, float]]" = OrderedDict()
+_MAX_VALIDATIONS = 256  # /api/keys/test без авторизации - размер ограничен
+_VALIDATION_TTL = 300  # секунды - для валидных ключей
+_VALIDATION_NEGATIVE_TTL = 10  # секунды - для невалидных, чтобы не долбить API
+_validation_lock = threading.Lock()
+
+# Сколько секунд переиспользуем последний ответ get_wallet_balance
+_WALLET_CACHE_TTL = 2.0
+
+# Сколько секунд переиспользуем последний ответ get_open_orders
+_ORDERS_CACHE_TTL = 2.0
+
+# Сколько секунд переиспользуем последний ответ get_positions_raw
+_POSITIONS_CACHE_TTL = 1.0
+
+# Кэш расшифрованных ключей: ExchangeAPI.id -> (api_key, api_secret, updated_at, cached_at)
+_KEY_CACHE: Dict[int, Tuple[str, str, Optional[datetime], float]] = {}
+_KEY_CACHE_TTL = 60  # секунды
+_key_cache_lock = threading.Lock()
+
+
+def _key_id(value: str) -> str:
+    """Отпечаток ключа для словарей-кэшей, чтобы ключи не лежали в них открыто"""
+    return hashlib.blake2b(value.encode(), digest_size=16).hexdigest()
+
+
+# ==================== HTTP СЕССИЯ ====================
+
+async def init_http_session() -> aiohttp.ClientSession:
+    """
+    Создать общую HTTP сессию (вызывается при старте приложения)
+    
+    Returns:
+        aiohttp.ClientSession
+    """
+    global _http_session
+    
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=_HTTP_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit_per_host=_HTTP_LIMIT_PER_HOST),
+        )
+        logger.info("✅ Bybit HTTP session created")
+    
+    return _http_session
+
+
+async def close_http_session() -> None:
+    """Закрыть общую HTTP сессию (вызывается при остановке приложения)"""
+    global _http_session
+    
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
+class BybitHTTP:
+    """
+    Минимальный async клиент Bybit V5 REST API
+    
+    Замена pybit.unified_trading.HTTP: реализованы только используемые
+    методы (те же имена и параметры), запросы подписываются HMAC-SHA256
+    и идут через общую aiohttp сессию
+    """
+    
+    def __init__(self, api_key: str, api_secret: str, testnet: bool = False, recv_window: int = 5000):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.recv_window = str(recv_window)
+        self.base_url = settings.BYBIT_TESTNET_BASE_URL if testnet else settings.BYBIT_API_BASE_URL
+    
+    def _sign(self, timestamp: str, payload: str) -> str:
+        """Подпись V5: HMAC_SHA256(secret, timestamp + api_key + recv_window + payload)"""
+        message = timestamp + self.api_key + self.recv_window + payload
+        return hmac.new(self.api_secret.encode(), message.encode(), hashlib.sha256).hexdigest()
+    
+    async def _get(self, path: str, params: Dict) -> Dict:
+        """Подписанный GET запрос, возвращает JSON ответ Bybit"""
+        query = urlencode(params)
+        timestamp = str(int(time.time() * 1000))
+        headers = {
+            "X-BAPI-API-KEY": self.api_key,
+            "X-BAPI-SIGN": self._sign(timestamp, query),
+            "X-BAPI-SIGN-TYPE": "2",
+            "X-BAPI-TIMESTAMP": timestamp,
+            "X-BAPI-RECV-WINDOW": self.recv_window,
+        }
+        
+        # encoded=True - строка запроса должна совпадать с подписанной
+        url = URL(f"{self.base_url}{path}?{query}", encoded=True)
+        session = await init_http_session()
+        async with session.get(url, headers=headers) as response:
+            return await response.json(content_type=None)
+    
+    async def get_wallet_balance(self, **params) -> Dict:
+        return await self._get("/v5/account/wallet-balance", params)
+    
+    async def get_positions(self, **params) -> Dict:
+        return await self._get("/v5/position/list", params)
+    
+    async def get_open_orders(self, **params) -> Dict:
+        return await self._get("/v5/order/realtime", params)
 
-_bybit_client = None
-_testnet_mode = False
 
+# ==================== КЛИЕНТ ====================
 
 class BybitClientWrapper:
     """Обертка над Bybit клиентом с исправленными параметрами"""
@@ -31,18 +162,69 @@ class BybitClientWrapper:
         self.testnet = testnet
         
         # Инициализируем клиент с УВЕЛИЧЕННЫМ recv_window
-        self.client = HTTP(
+        self.client = BybitHTTP(
             testnet=testnet,
             api_key=api_key,
             api_secret=api_secret,
             recv_window=15000,  # УВЕЛИЧИЛИ с 5000 до 15000ms!
         )
+        
+        # Последний ответ get_wallet_balance: (monotonic time, payload)
+        self._wallet_cache: Optional[Tuple[float, Dict]] = None
+        # Последний ответ get_open_orders: (monotonic time, payload)
+        self._orders_cache: Optional[Tuple[float, Dict]] = None
+        # Последний ответ get_positions_raw и запрос к Bybit "в полёте":
+        # параллельные вызовы ждут один запрос, а не делают каждый свой
+        self._positions_cache: Optional[Tuple[float, Dict]] = None
+        self._positions_inflight: Optional[asyncio.Task] = None
         logger.info(f"✅ Bybit API initialized ({'testnet' if testnet else 'live'})")
     
-    def validate_credentials(self) -> bool:
-        """Проверить что ключи валидны"""
+    async def _get_wallet_raw(self) -> Dict:
+        """
+        Сырой ответ get_wallet_balance с коротким кэшем
+        
+        validate_credentials и get_account_info запрашивают одно и то же,
+        поэтому ответ переиспользуется в течение _WALLET_CACHE_TTL секунд
+        """
+        cached = self._wallet_cache
+        if cached and time.monotonic() - cached[0] < _WALLET_CACHE_TTL:
+            return cached[1]
+        
+        result = await self.client.get_wallet_balance(accountType="UNIFIED")
+        if result and result.get('retCode') == 0:
+            self._wallet_cache = (time.monotonic(), result)
+        return result
+    
+    async def validate_credentials(self) -> bool:
+        """
+        Проверить что ключи валидны
+        
+        Результат кэшируется на _VALIDATION_TTL секунд (невалидный - на
+        _VALIDATION_NEGATIVE_TTL), повторные проверки не ходят в Bybit
+        """
+        cache_key = (_key_id(self.api_key), _key_id(self.api_secret), self.testnet)
+        
+        with _validation_lock:
+            cached = _VALIDATION_CACHE.get(cache_key)
+        
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        
+        is_valid = await self._check_credentials()
+        ttl = _VALIDATION_TTL if is_valid else _VALIDATION_NEGATIVE_TTL
+        
+        with _validation_lock:
+            _VALIDATION_CACHE[cache_key] = (is_valid, time.monotonic() + ttl)
+            _VALIDATION_CACHE.move_to_end(cache_key)
+            while len(_VALIDATION_CACHE) > _MAX_VALIDATIONS:
+                _VALIDATION_CACHE.popitem(last=False)
+        
+        return is_valid
+    
+    async def _check_credentials(self) -> bool:
+        """Проверить ключи запросом к Bybit (без кэша)"""
         try:
-            result = self.client.get_wallet_balance(accountType="UNIFIED")
+            result = await self._get_wallet_raw()
             if result and result.get('retCode') == 0:
                 logger.info("✅ Bybit credentials validated")
                 return True
@@ -53,7 +235,7 @@ class BybitClientWrapper:
             logger.error(f"Credential validation failed: {e}")
             return False
     
-    def get_account_info(self) -> Dict:
+    async def get_account_info(self) -> Dict:
         """
         Получить информацию об аккаунте
         
@@ -65,7 +247,7 @@ class BybitClientWrapper:
             - total_unrealised_loss
         """
         try:
-            result = self.client.get_wallet_balance(accountType="UNIFIED")
+            result = await self._get_wallet_raw()
             
             if result and result.get('retCode') == 0:
                 data = result.get('result', {})
@@ -95,10 +277,49 @@ class BybitClientWrapper:
                 "total_unrealised_loss": 0,
             }
     
-    def get_positions(self) -> list:
+    async def get_positions_raw(self) -> Dict:
+        """
+        Получить позиции (сырой ответ /v5/position/list, все USDT контракты)
+        
+        Single-flight: /api/positions, /api/positions/open и вкладки дашборда
+        опрашивают одновременно - в Bybit уходит один запрос, остальные ждут
+        ту же задачу и получают тот же результат. Ошибка (исключение, таймаут,
+        retCode != 0) тоже общая - ожидающие не повторяют запрос по очереди.
+        Успешный ответ переиспользуется _POSITIONS_CACHE_TTL секунд
+        """
+        cached = self._positions_cache
+        if cached and time.monotonic() - cached[0] < _POSITIONS_CACHE_TTL:
+            return cached[1]
+        
+        task = self._positions_inflight
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_positions())
+            self._positions_inflight = task
+            task.add_done_callback(self._positions_done)
+        
+        # shield: отмена одного ожидающего (клиент отключился) не отменяет
+        # запрос для остальных
+        return await asyncio.shield(task)
+    
+    async def _fetch_positions(self) -> Dict:
+        """Один запрос /v5/position/list; успешный ответ - в кэш"""
+        result = await self.client.get_positions(category="linear", settleCoin="USDT")
+        if result and result.get('retCode') == 0:
+            self._positions_cache = (time.monotonic(), result)
+        return result
+    
+    def _positions_done(self, task: asyncio.Task) -> None:
+        """Запрос завершён - следующий вызов после TTL начнёт новый"""
+        if self._positions_inflight is task:
+            self._positions_inflight = None
+        # Исключение забирают ожидающие; если все отменены - не шумим в лог
+        if not task.cancelled():
+            task.exception()
+    
+    async def get_positions(self) -> list:
         """Получить открытые позиции"""
         try:
-            result = self.client.get_open_orders(category="linear")
+            result = await self.get_positions_raw()
             
             if result and result.get('retCode') == 0:
                 data = result.get('result', {})
@@ -110,6 +331,46 @@ class BybitClientWrapper:
         except Exception as e:
             logger.error(f"Failed to get positions: {e}")
             return []
+    
+    async def get_open_orders(self) -> Dict:
+        """
+        Получить активные ордеры (сырой ответ /v5/order/realtime)
+        
+        Для linear Bybit требует symbol, baseCoin или settleCoin -
+        как и в get_positions, берём все USDT контракты.
+        
+        /api/orders и /api/orders/active опрашиваются вместе, поэтому
+        успешный ответ переиспользуется в течение _ORDERS_CACHE_TTL секунд
+        """
+        cached = self._orders_cache
+        if cached and time.monotonic() - cached[0] < _ORDERS_CACHE_TTL:
+            return cached[1]
+        
+        result = await self.client.get_open_orders(category="linear", settleCoin="USDT")
+        if result and result.get('retCode') == 0:
+            self._orders_cache = (time.monotonic(), result)
+        return result
+    
+    async def get_snapshot(self) -> Dict:
+        """
+        Получить баланс и позиции параллельно
+        
+        Оба запроса выполняются одновременно - общее время ~ max,
+        а не сумма RTT
+        
+        Returns:
+            Dict с ключами:
+            - account (как в get_account_info)
+            - positions (как в get_positions)
+        """
+        account, positions = await asyncio.gather(
+            self.get_account_info(),
+            self.get_positions(),
+        )
+        return {
+            "account": account,
+            "positions": positions,
+        }
 
 
 # ==================== ГЛОБАЛЬНЫЕ ФУНКЦИИ ====================
@@ -118,6 +379,9 @@ def get_bybit_client(api_key: str, api_secret: str, testnet: bool = False) -> By
     """
     Получить или создать Bybit клиент
     
+    Клиенты хранятся в пуле по (отпечаток api_key, testnet), так что при
+    чередовании ключей HTTP сессия (и TLS соединение) не пересоздаются
+    
     Args:
         api_key: API ключ Bybit
         api_secret: API секрет Bybit
@@ -126,34 +390,65 @@ def get_bybit_client(api_key: str, api_secret: str, testnet: bool = False) -> By
     Returns:
         BybitClientWrapper
     """
-    global _bybit_client, _testnet_mode
+    key = (_key_id(api_key), testnet)
     
-    # Если параметры изменились, создаем новый клиент
-    if (_bybit_client is None or 
-        _testnet_mode != testnet or 
-        _bybit_client.api_key != api_key):
+    with _clients_lock:
+        client = _CLIENTS.get(key)
         
-        try:
-            _bybit_client = BybitClientWrapper(api_key, api_secret, testnet)
-            _testnet_mode = testnet
+        # Если секрет изменился, создаем новый клиент
+        if client is None or client.api_secret != api_secret:
+            try:
+                client = BybitClientWrapper(api_key, api_secret, testnet)
+            except Exception as e:
+                logger.error(f"Failed to create Bybit client: {e}")
+                raise
+            
+            _CLIENTS[key] = client
             logger.info("✅ New Bybit client created")
-        except Exception as e:
-            logger.error(f"Failed to create Bybit client: {e}")
-            raise
+        
+        _CLIENTS.move_to_end(key)
+        while len(_CLIENTS) > _MAX_CLIENTS:
+            _CLIENTS.popitem(last=False)
     
-    return _bybit_client
+    return client
 
 
-def reset_bybit_client():
-    """Сбросить клиент (для переключения ключей)"""
-    global _bybit_client
-    _bybit_client = None
+def reset_bybit_client(api_key: Optional[str] = None, clear_validation: bool = True):
+    """
+    Сбросить клиент (для переключения ключей)
+    
+    Args:
+        api_key: Сбросить только клиенты этого ключа (по умолчанию - все)
+        clear_validation: Сбросить и кэш validate_credentials. False - когда
+            результат проверки только что получен и должен остаться в кэше
+    """
+    key_id = _key_id(api_key) if api_key is not None else None
+    
+    with _clients_lock:
+        for key in [k for k in _CLIENTS if key_id is None or k[0] == key_id]:
+            client = _CLIENTS.pop(key)
+            client._wallet_cache = None
+            client._orders_cache = None
+            client._positions_cache = None
+    
+    if clear_validation:
+        with _validation_lock:
+            for key in [k for k in _VALIDATION_CACHE if key_id is None or k[0] == key_id]:
+                del _VALIDATION_CACHE[key]
+    
     logger.info("🔄 Bybit client reset")
 
 
-def get_account_balance() -> Dict:
+def _last_used_client() -> Optional[BybitClientWrapper]:
+    """Последний использованный клиент из пула"""
+    with _clients_lock:
+        return next(reversed(_CLIENTS.values()), None)
+
+
+async def get_account_balance() -> Dict:
     """Удобная функция для получения баланса"""
-    if not _bybit_client:
+    client = _last_used_client()
+    if not client:
         return {
             "total_wallet_balance": 0,
             "total_equity": 0,
@@ -161,12 +456,79 @@ def get_account_balance() -> Dict:
             "total_unrealised_loss": 0,
         }
     
-    return _bybit_client.get_account_info()
+    return await client.get_account_info()
 
 
-def get_positions() -> list:
+async def get_positions() -> list:
     """Удобная функция для получения позиций"""
-    if not _bybit_client:
+    client = _last_used_client()
+    if not client:
         return []
     
-    return _bybit_client.get_positions()
+    return await client.get_positions()
+
+
+# ==================== КЛЮЧИ ====================
+
+def has_credentials(exchange) -> bool:
+    """
+    Есть ли у биржи ключи для запросов к Bybit
+    
+    Пустые ключи (заглушка в dev/тестах) - то же, что ключи не добавлены:
+    их расшифровка падает, а клиент с пустыми ключами не авторизуется
+    
+    Args:
+        exchange: Строка ExchangeAPI или None
+    
+    Returns:
+        bool: True, если оба зашифрованных ключа непустые
+    """
+    return bool(exchange and exchange.api_key_encrypted and exchange.api_secret_encrypted)
+
+
+def get_credentials(exchange) -> Tuple[str, str]:
+    """
+    Получить расшифрованные API ключи биржи
+    
+    Расшифровка (MAC + AES) кэшируется на _KEY_CACHE_TTL секунд по
+    ExchangeAPI.id. Запись действительна, пока не изменился updated_at
+    строки, при добавлении/удалении ключей кэш сбрасывается
+    
+    Args:
+        exchange: Строка ExchangeAPI
+    
+    Returns:
+        Tuple[str, str]: (api_key, api_secret)
+    """
+    with _key_cache_lock:
+        cached = _KEY_CACHE.get(exchange.id)
+    
+    if (
+        cached
+        and cached[2] == exchange.updated_at
+        and time.monotonic() - cached[3] < _KEY_CACHE_TTL
+    ):
+        return cached[0], cached[1]
+    
+    encryptor = get_encryption_manager()
+    api_key = encryptor.decrypt(exchange.api_key_encrypted)
+    api_secret = encryptor.decrypt(exchange.api_secret_encrypted)
+    
+    with _key_cache_lock:
+        _KEY_CACHE[exchange.id] = (api_key, api_secret, exchange.updated_at, time.monotonic())
+    
+    return api_key, api_secret
+
+
+def clear_credentials_cache(exchange_id: Optional[int] = None) -> None:
+    """
+    Сбросить кэш расшифрованных ключей
+    
+    Args:
+        exchange_id: ID биржи (по умолчанию - весь кэш)
+    """
+    with _key_cache_lock:
+        if exchange_id is None:
+            _KEY_CACHE.clear()
+        else:
+            _KEY_CACHE.pop(exchange_id, None)
@@ -6,32 +6,63 @@ database.py - Инициализация БД
 Назначение: SQLAlchemy engine и session manager
 
 Основные этапы:
-1. Создаём подключение к SQLite
+1. Создаём подключение к SQLite (sync + async engine)
 2. Инициализируем session factory
 3. Создаём все таблицы из models.py
 4. Предоставляем dependency injection для routes
 """
 
-from sqlalchemy import create_engine, event
+from sqlalchemy import create_engine, event, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
+from typing import AsyncIterator
 import logging
+import sqlite3
 
 from config import get_settings
-from models import Base
+from models import Base, Event, EventType
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
 # ==================== DATABASE CONFIGURATION ====================
 
+# DATABASE_URL задаётся с async-драйвером (sqlite+aiosqlite, postgresql+asyncpg).
+# Для sync engine (init_db, sync routes) берём стандартный драйвер того же backend
+SYNC_DATABASE_URL = make_url(settings.DATABASE_URL)
+SYNC_DATABASE_URL = SYNC_DATABASE_URL.set(drivername=SYNC_DATABASE_URL.get_backend_name())
+
+
+def _pool_options(url, queue_pool_class=QueuePool) -> dict:
+    """
+    Параметры пула соединений для engine
+    
+    In-memory SQLite живёт внутри одного соединения, поэтому для него
+    StaticPool. Для остальных БД - QueuePool с настройками из Settings
+    (класс пула задаём явно: для aiosqlite по умолчанию NullPool)
+    """
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {"poolclass": StaticPool}
+    
+    return {
+        "poolclass": queue_pool_class,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+
 # Создаём engine
-# Для SQLite используем StaticPool чтобы избежать проблем с потоками
+# Для SQLite разрешаем использование соединения из разных потоков
 engine = create_engine(
-    settings.DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    poolclass=StaticPool,
+    SYNC_DATABASE_URL,
+    connect_args={"check_same_thread": False} if SYNC_DATABASE_URL.get_backend_name() == "sqlite" else {},
     echo=settings.DEBUG,  # Логирование SQL запросов в debug mode
+    **_pool_options(SYNC_DATABASE_URL),
 )
 
 # Создаём session factory
@@ -42,6 +73,47 @@ SessionLocal = sessionmaker(
     expire_on_commit=False,
 )
 
+# Async engine - не блокирует event loop в async def routes
+async_engine = create_async_engine(
+    settings.DATABASE_URL,
+    echo=settings.DEBUG,
+    **_pool_options(make_url(settings.DATABASE_URL), AsyncAdaptedQueuePool),
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+# ==================== SQLITE PRAGMAS ====================
+
+# WAL: читатели не блокируются писателем, synchronous=NORMAL - fsync только
+# на checkpoint. mmap и cache_size (-65536 = 64 MB) уменьшают число read()
+_SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Применить PRAGMA к каждому новому соединению SQLite"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in _SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+if SYNC_DATABASE_URL.get_backend_name() == "sqlite":
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
 # ==================== DATABASE INITIALIZATION ====================
 
 def init_db() -> None:
@@ -50,9 +122,31 @@ def init_db() -> None:
     
     Вызывается при запуске приложения
     """
+    # Пул раздаёт SQLite соединения разным потокам (check_same_thread=False) -
+    # это безопасно только если libsqlite3 собран не в single-thread режиме
+    if SYNC_DATABASE_URL.get_backend_name() == "sqlite" and sqlite3.threadsafety == 0:
+        logger.warning("⚠️  sqlite3 is built single-threaded - pooled connections are not thread-safe")
+    
     try:
         # Создаём все таблицы из Base.metadata
         Base.metadata.create_all(bind=engine)
+        
+        # create_all не трогает уже существующие таблицы - досоздаём
+        # индексы, добавленные в модели после создания БД
+        with engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(bind=conn, checkfirst=True)
+            
+            # events.event_type раньше был Enum и хранил имена членов
+            # ('POSITION_OPENED'), теперь String со значениями ('position_opened').
+            # Переписываем старые строки; повторный запуск ничего не меняет
+            for event_type in EventType:
+                conn.execute(
+                    update(Event)
+                    .where(Event.event_type == event_type.name)
+                    .values(event_type=event_type.value)
+                )
         logger.info("✅ Database initialized successfully")
     except Exception as e:
         logger.error(f"❌ Database initialization failed: {e}", exc_info=True)
@@ -81,6 +175,23 @@ def get_db() -> Session:
         db.close()
 
 
+async def get_async_db() -> AsyncIterator[AsyncSession]:
+    """
+    Dependency для получения async БД сессии в async def routes
+    
+    Usage:
+        @app.get("/api/items")
+        async def get_items(db: AsyncSession = Depends(get_async_db)):
+            result = await db.execute(select(Item))
+            return result.scalars().all()
+    
+    Yields:
+        AsyncSession: SQLAlchemy async session
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 # ==================== CONNECTION HELPERS ====================
 
 def get_db_session() -> Session:
@@ -100,7 +211,8 @@ def get_db_session() -> Session:
     return SessionLocal()
 
 
-def close_db() -> None:
+async def close_db() -> None:
     """Закрыть все подключения"""
+    await async_engine.dispose()
     engine.dispose()
     logger.info("Database connections closed")
@@ -11,9 +11,12 @@ Endpoints:
 """
 
 from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import and_, func, literal_column, or_, select, union_all
 from sqlalchemy.orm import Session
 import logging
-from typing import Dict
+from datetime import datetime
+from typing import Optional
 
 from database import get_db
 from models import ExchangeAPI, Event
@@ -22,78 +25,171 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/events", tags=["Events"])
 
 
+# Колонки списка событий (без Event.data)
+_EVENT_COLUMNS = (
+    Event.id,
+    Event.event_type,
+    Event.title,
+    Event.description,
+    Event.severity,
+    Event.created_at,
+    Event.position_id,
+)
+
+
 # ===================== ENDPOINTS =====================
 
 @router.get("")
-async def get_events(
+def get_events(
     exchange_id: int = Query(1, description="ID биржи"),
     limit: int = Query(100, ge=1, le=1000),
     offset: int = Query(0, ge=0),
     event_type: str = Query(None, description="Фильтр по типу события"),
     severity: str = Query(None, description="Фильтр по серьезности"),
+    before_ts: Optional[datetime] = Query(None, description="Курсор: created_at последнего события"),
+    before_id: Optional[int] = Query(None, description="Курсор: id последнего события"),
     db: Session = Depends(get_db)
-) -> Dict:
+) -> ORJSONResponse:
     """
     Получить события
     
     Args:
         exchange_id: ID биржи
         limit: Максимум записей
-        offset: Смещение
+        offset: Смещение (устарело, используйте курсор before_ts/before_id)
         event_type: Фильтр по типу (open, close, tp, sl, error)
         severity: Фильтр по серьезности (info, warning, error)
+        before_ts: Курсор - вернуть события старше (created_at, id)
+        before_id: Курсор - id, разрешает равенство created_at; без
+            before_ts - курсор внутри событий без created_at (они в конце)
         db: БД сессия
         
     Returns:
-        Dict: Список событий
+        ORJSONResponse: Список событий, total (всего по фильтру, после курсора)
+              и next_cursor для следующей страницы
     """
     try:
-        # Проверяем что биржа существует
-        exchange = db.query(ExchangeAPI).filter(
-            ExchangeAPI.id == exchange_id
-        ).first()
+        # Фильтры (те же для страницы и для подсчёта total)
+        filters = [Event.exchange_id == exchange_id]
         
-        if not exchange:
-            raise HTTPException(
-                status_code=404,
-                detail=f"Exchange {exchange_id} not found"
-            )
+        if event_type:
+            filters.append(Event.event_type == event_type)
+        
+        if severity:
+            filters.append(Event.severity == severity)
+        
+        # Порядок: (created_at DESC, id DESC), события без created_at - после
+        # всех датированных. Датированные и недатированные читаются разными
+        # seek: "created_at < ? OR created_at IS NULL" в одном условии не даёт
+        # SQLite взять диапазон created_at по индексу
+        dated = filters + [Event.created_at.isnot(None)]
+        undated = filters + [Event.created_at.is_(None)]
+        
+        # Keyset пагинация: seek по индексу вместо пропуска offset строк
+        if before_ts is not None:
+            if before_id is not None:
+                # created_at <= ? дублирует OR как границу диапазона
+                dated += [
+                    Event.created_at <= before_ts,
+                    or_(
+                        Event.created_at < before_ts,
+                        and_(Event.created_at == before_ts, Event.id < before_id),
+                    ),
+                ]
+            else:
+                dated.append(Event.created_at < before_ts)
+        elif before_id is not None:
+            # Курсор внутри хвоста без created_at - датированные уже пройдены
+            dated = None
+            undated.append(Event.id < before_id)
         
-        # Получаем события
-        query = db.query(Event).filter(
-            Event.exchange_id == exchange_id
+        # Каждая часть отдаёт не больше limit + 1 + offset строк, страница
+        # собирается UNION ALL и сортирует только их. limit + 1: лишняя
+        # строка означает, что есть следующая страница
+        legs = []
+        if dated is not None:
+            legs.append(
+                db.query(*_EVENT_COLUMNS, literal_column("0").label("leg"))
+                .filter(*dated)
+                .order_by(Event.created_at.desc(), Event.id.desc())
+                .limit(limit + 1 + offset)
+                .subquery()
+            )
+        legs.append(
+            db.query(*_EVENT_COLUMNS, literal_column("1").label("leg"))
+            .filter(*undated)
+            .order_by(Event.id.desc())
+            .limit(limit + 1 + offset)
+            .subquery()
         )
+        page = legs[0] if len(legs) == 1 else union_all(
+            *(select(leg) for leg in legs)
+        ).subquery()
         
-        if event_type:
-            query = query.filter(Event.event_type == event_type)
+        # Название биржи приходит скалярным подзапросом в каждой строке -
+        # события и проверка биржи одним запросом
+        exchange_name = db.query(ExchangeAPI.exchange).filter(
+            ExchangeAPI.id == exchange_id
+        ).scalar_subquery()
         
-        if severity:
-            query = query.filter(Event.severity == severity)
+        query = db.query(
+            *(page.c[column.key] for column in _EVENT_COLUMNS),
+            exchange_name.label("exchange_name"),
+        ).order_by(page.c.leg, page.c.created_at.desc(), page.c.id.desc()).limit(limit + 1)
+        if offset:
+            query = query.offset(offset)
+        events = query.all()
+        has_more = len(events) > limit
+        events = events[:limit]
         
-        events = query.order_by(
-            Event.created_at.desc()
-        ).limit(limit).offset(offset).all()
+        if events:
+            exchange = events[0].exchange_name
+        else:
+            # Пустая страница - отдельно проверяем, существует ли биржа
+            exchange = db.query(ExchangeAPI.exchange).filter(
+                ExchangeAPI.id == exchange_id
+            ).scalar()
+            if exchange is None:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Exchange {exchange_id} not found"
+                )
         
-        result = []
-        for event in events:
-            result.append({
+        # Всего по фильтру - отдельным COUNT по индексу: оконный COUNT(*) OVER()
+        # в запросе страницы заставлял SQLite читать и сортировать все
+        # подходящие строки до LIMIT вместо seek по idx_events_list.
+        # Датированные и хвост без created_at считаются раздельно по той же
+        # причине, что и читаются
+        total = db.query(func.count(Event.id)).filter(*undated).scalar()
+        if dated is not None:
+            total += db.query(func.count(Event.id)).filter(*dated).scalar()
+        
+        result = [
+            {
                 "id": event.id,
                 "event_type": event.event_type,
                 "title": event.title,
                 "description": event.description,
                 "severity": event.severity,
-                "created_at": event.created_at.isoformat() if event.created_at else None,
+                "created_at": event.created_at,
                 "position_id": event.position_id,
-            })
+            }
+            for event in events
+        ]
         
-        return {
+        # datetime сериализует orjson (ISO 8601), без jsonable_encoder
+        return ORJSONResponse({
             "status": "success",
-            "exchange": exchange.exchange,
+            "exchange": exchange,
             "events": result,
-            "total": len(result),
+            "total": total,
             "limit": limit,
             "offset": offset,
-        }
+            "next_cursor": {
+                "before_ts": events[-1].created_at,
+                "before_id": events[-1].id,
+            } if has_more else None,
+        })
     
     except HTTPException:
         raise
@@ -106,10 +202,10 @@ async def get_events(
 
 
 @router.get("/{event_id}")
-async def get_event(
+def get_event(
     event_id: int,
     db: Session = Depends(get_db)
-) -> Dict:
+) -> ORJSONResponse:
     """
     Получить детали события
     
@@ -118,10 +214,20 @@ async def get_event(
         db: БД сессия
         
     Returns:
-        Dict: Детали события
+        ORJSONResponse: Детали события
     """
     try:
-        event = db.query(Event).filter(
+        event = db.query(
+            Event.id,
+            Event.exchange_id,
+            Event.position_id,
+            Event.event_type,
+            Event.title,
+            Event.description,
+            Event.data,
+            Event.severity,
+            Event.created_at,
+        ).filter(
             Event.id == event_id
         ).first()
         
@@ -131,7 +237,7 @@ async def get_event(
                 detail=f"Event {event_id} not found"
             )
         
-        return {
+        return ORJSONResponse({
             "status": "success",
             "event": {
                 "id": event.id,
@@ -142,9 +248,9 @@ async def get_event(
                 "description": event.description,
                 "data": event.data,
                 "severity": event.severity,
-                "created_at": event.created_at.isoformat() if event.created_at else None,
+                "created_at": event.created_at,
             }
-        }
+        })
     
     except HTTPException:
         raise
@@ -13,19 +13,52 @@ models/__init__.py & models/position.py - SQLAlchemy модели для БД
 5. ClosingLogic - Настройки логики закрытия
 """
 
-from datetime import datetime
 from typing import Optional
 from sqlalchemy import (
     Column, Integer, String, Float, DateTime, 
-    Boolean, Text, Enum, Index, ForeignKey, create_engine
+    Boolean, Text, Index, ForeignKey, CheckConstraint, create_engine
 )
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
+from sqlalchemy.sql.expression import FunctionElement
 import enum
 
 Base = declarative_base()
 
 
+# ===================== DB-SIDE TIMESTAMPS =====================
+
+class utcnow(FunctionElement):
+    """
+    Текущее UTC время, вычисляемое самой БД (default / server_default / onupdate)
+    
+    Python не создаёт datetime и не передаёт его параметром на каждую вставку.
+    default= дублирует server_default: выражение попадает прямо в INSERT,
+    поэтому работает и в старых таблицах, созданных без DEFAULT (SQLite не
+    умеет добавить DEFAULT существующей колонке, init_db не мигрирует)
+    """
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow, "sqlite")
+def _sqlite_utcnow(element, compiler, **kw):
+    # Тот же формат, что пишет SQLAlchemy DateTime (YYYY-MM-DD HH:MM:SS.ffffff),
+    # иначе строковое сравнение со старыми строками и параметрами ломается
+    return "(STRFTIME('%Y-%m-%d %H:%M:%f000', 'now'))"
+
+
+@compiles(utcnow, "postgresql")
+def _pg_utcnow(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+@compiles(utcnow)
+def _default_utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
 # ===================== EXCHANGE API =====================
 
 class ExchangeAPI(Base):
@@ -35,13 +68,11 @@ class ExchangeAPI(Base):
     ⚠️ ВАЖНО: API ключи ВСЕГДА должны быть зашифрованы в БД!
     """
     __tablename__ = "exchange_api"
-    __table_args__ = (
-        Index('idx_exchange', 'exchange'),
-    )
     
     id = Column(Integer, primary_key=True)
     
     # Название биржи: "bybit", "okx", "binance"
+    # UNIQUE уже даёт B-tree индекс (lookup по exchange и ON CONFLICT (exchange))
     exchange = Column(String(50), unique=True, nullable=False)
     
     # API KEY (зашифрованный!)
@@ -67,8 +98,8 @@ class ExchangeAPI(Base):
     failed_closures = Column(Integer, default=0)
     
     # Метаданные
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow(), server_default=utcnow())
+    updated_at = Column(DateTime, default=utcnow(), server_default=utcnow(), onupdate=utcnow())
     
     # Relationship
     positions = relationship("Position", back_populates="exchange_api", cascade="all, delete-orphan")
@@ -80,6 +111,16 @@ class ExchangeAPI(Base):
         return f"<ExchangeAPI {self.exchange}>"
 
 
+# Колонки ExchangeAPI для get_credentials() и клиента Bybit - без ORM объекта
+CREDENTIAL_COLUMNS = (
+    ExchangeAPI.id,
+    ExchangeAPI.api_key_encrypted,
+    ExchangeAPI.api_secret_encrypted,
+    ExchangeAPI.testnet,
+    ExchangeAPI.updated_at,
+)
+
+
 # ===================== POSITION =====================
 
 class Position(Base):
@@ -118,7 +159,7 @@ class Position(Base):
     
     # Логика закрытия
     has_tp = Column(Boolean, default=False)       # Есть ли TP?
-    opened_at = Column(DateTime, default=datetime.utcnow)
+    opened_at = Column(DateTime, default=utcnow(), server_default=utcnow())
     needs_auto_close = Column(Boolean, default=False)  # Нужно ли закрывать?
     close_reason = Column(String(100), nullable=True)  # Причина закрытия
     
@@ -127,8 +168,8 @@ class Position(Base):
     order_id = Column(String(100), nullable=True)     # ID ордера
     
     # Метаданные
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow(), server_default=utcnow())
+    updated_at = Column(DateTime, default=utcnow(), server_default=utcnow(), onupdate=utcnow())
     
     # Relationship
     trades = relationship("Trade", back_populates="position", cascade="all, delete-orphan")
@@ -147,6 +188,10 @@ class Trade(Base):
     __tablename__ = "trades"
     __table_args__ = (
         Index('idx_exchange_closed', 'exchange_id', 'closed_at'),
+        # Агрегаты /api/trades/stats читаются из индекса без таблицы
+        Index('idx_trades_exchange_pnl', 'exchange_id', 'net_pnl'),
+        # /api/trades с фильтрами symbol + status: ORDER BY closed_at DESC из индекса
+        Index('idx_trades_list', 'exchange_id', 'symbol', 'status', 'closed_at'),
         Index('idx_status', 'status'),
     )
     
@@ -174,7 +219,7 @@ class Trade(Base):
     
     # Время
     opened_at = Column(DateTime, nullable=False)
-    closed_at = Column(DateTime, default=datetime.utcnow)
+    closed_at = Column(DateTime, default=utcnow(), server_default=utcnow())
     duration_seconds = Column(Integer)
     
     # Статус
@@ -182,7 +227,7 @@ class Trade(Base):
     close_reason = Column(String(200), nullable=True)
     
     # Метаданные
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow(), server_default=utcnow())
     
     def __repr__(self):
         return f"<Trade {self.symbol} {self.side} PnL={self.pnl}>"
@@ -213,8 +258,14 @@ class Event(Base):
     """
     __tablename__ = "events"
     __table_args__ = (
-        Index('idx_exchange_created', 'exchange_id', 'created_at'),
+        # Список событий: WHERE exchange_id [AND event_type] [AND severity]
+        # ORDER BY created_at DESC - фильтры проверяются по индексу без чтения строк
+        Index('idx_events_list', 'exchange_id', 'created_at', 'event_type', 'severity'),
         Index('idx_event_type', 'event_type'),
+        CheckConstraint(
+            "event_type IN (" + ", ".join(f"'{t.value}'" for t in EventType) + ")",
+            name="ck_events_event_type",
+        ),
     )
     
     id = Column(Integer, primary_key=True)
@@ -227,18 +278,19 @@ class Event(Base):
     position = relationship("Position", back_populates="events")
     
     # Информация о событии
-    event_type = Column(Enum(EventType), nullable=False)
+    # Значение EventType (EventType.X.value) - строка без enum-конверсии на чтении
+    event_type = Column(String(32), nullable=False)
     title = Column(String(200), nullable=False)
     description = Column(Text, nullable=True)
     
-    # Данные события (JSON-like)
-    data = Column(Text, nullable=True)  # JSON string
+    # Данные события (JSON-like), загружаются только при обращении
+    data = deferred(Column(Text, nullable=True))  # JSON string
     
     # Уровень важности
     severity = Column(String(20), default="info")  # "info", "warning", "error", "critical"
     
     # Временные метки
-    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    created_at = Column(DateTime, default=utcnow(), server_default=utcnow(), index=True)
     
     def __repr__(self):
         return f"<Event {self.event_type} at {self.created_at}>"
@@ -281,8 +333,8 @@ class ClosingLogic(Base):
     max_retries = Column(Integer, default=3)
     
     # Метаданные
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow(), server_default=utcnow())
+    updated_at = Column(DateTime, default=utcnow(), server_default=utcnow(), onupdate=utcnow())
     updated_by = Column(String(100), nullable=True)  # Кто изменил
     
     def __repr__(self):
@@ -312,8 +364,8 @@ class Settings(Base):
     description = Column(Text, nullable=True)
     
     # Метаданные
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow(), server_default=utcnow())
+    updated_at = Column(DateTime, default=utcnow(), server_default=utcnow(), onupdate=utcnow())
     
     def __repr__(self):
         return f"<Settings {self.key}={self.value}>"
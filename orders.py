@@ -7,28 +7,30 @@ routes/orders.py - API endpoints для ордеров (НОВЫЙ v1.0)
 """
 
 from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 from typing import Dict
 
-from database import get_db
-from models import ExchangeAPI
-from utils.crypto import get_encryption_manager
-from bybit_service import get_bybit_client
+from database import get_async_db
+from models import CREDENTIAL_COLUMNS, ExchangeAPI
+from bybit_service import get_bybit_client, get_credentials, has_credentials
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/orders", tags=["Orders"])
 
 
 @router.get("/")
-async def get_orders(db: Session = Depends(get_db)) -> Dict:
+async def get_orders(db: AsyncSession = Depends(get_async_db)) -> Dict:
     """Получить активные ордеры"""
     try:
-        exchange = db.query(ExchangeAPI).filter(
-            ExchangeAPI.exchange == "bybit"
-        ).first()
+        exchange = (await db.execute(
+            select(*CREDENTIAL_COLUMNS).where(ExchangeAPI.exchange == "bybit")
+        )).one_or_none()
+        # Соединение возвращается в пул до запроса к Bybit, а не после ответа
+        await db.close()
         
-        if not exchange:
+        if not has_credentials(exchange):
             return {
                 "status": "error",
                 "message": "API ключи не добавлены",
@@ -37,21 +39,18 @@ async def get_orders(db: Session = Depends(get_db)) -> Dict:
             }
         
         try:
-            encryptor = get_encryption_manager()
-            api_key = encryptor.decrypt(exchange.api_key_encrypted)
-            api_secret = encryptor.decrypt(exchange.api_secret_encrypted)
+            api_key, api_secret = get_credentials(exchange)
             
             client = get_bybit_client(api_key, api_secret, exchange.testnet)
             
             # Получаем активные ордеры
-            result = client.client.get_open_orders(category="linear")
+            result = await client.get_open_orders()
             
             if result and result.get('retCode') == 0:
                 orders = result.get('result', {}).get('list', [])
                 
-                formatted_orders = []
-                for order in orders:
-                    formatted_orders.append({
+                formatted_orders = [
+                    {
                         "symbol": order.get('symbol'),
                         "side": order.get('side'),
                         "order_type": order.get('orderType'),
@@ -60,7 +59,9 @@ async def get_orders(db: Session = Depends(get_db)) -> Dict:
                         "status": order.get('orderStatus'),
                         "order_id": order.get('orderId'),
                         "created_at": order.get('createdTime'),
-                    })
+                    }
+                    for order in orders
+                ]
                 
                 logger.info(f"✅ Retrieved {len(formatted_orders)} orders")
                 
@@ -92,26 +93,26 @@ async def get_orders(db: Session = Depends(get_db)) -> Dict:
 
 
 @router.get("/active")
-async def get_active_orders_count(db: Session = Depends(get_db)) -> Dict:
+async def get_active_orders_count(db: AsyncSession = Depends(get_async_db)) -> Dict:
     """Получить количество активных ордеров"""
     try:
-        exchange = db.query(ExchangeAPI).filter(
-            ExchangeAPI.exchange == "bybit"
-        ).first()
+        exchange = (await db.execute(
+            select(*CREDENTIAL_COLUMNS).where(ExchangeAPI.exchange == "bybit")
+        )).one_or_none()
+        # Соединение возвращается в пул до запроса к Bybit, а не после ответа
+        await db.close()
         
-        if not exchange:
+        if not has_credentials(exchange):
             return {
                 "status": "success",
                 "active_orders": 0,
             }
         
         try:
-            encryptor = get_encryption_manager()
-            api_key = encryptor.decrypt(exchange.api_key_encrypted)
-            api_secret = encryptor.decrypt(exchange.api_secret_encrypted)
+            api_key, api_secret = get_credentials(exchange)
             
             client = get_bybit_client(api_key, api_secret, exchange.testnet)
-            result = client.client.get_open_orders(category="linear")
+            result = await client.get_open_orders()
             
             if result and result.get('retCode') == 0:
                 orders = result.get('result', {}).get('list', [])
@@ -7,28 +7,51 @@ routes/positions.py - API endpoints для позиций (НОВЫЙ v1.0)
 """
 
 from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import logging
-from typing import Dict
+from typing import Dict, List
 
-from database import get_db
-from models import ExchangeAPI
-from utils.crypto import get_encryption_manager
-from bybit_service import get_bybit_client
+from database import get_async_db
+from models import CREDENTIAL_COLUMNS, ExchangeAPI
+from bybit_service import get_bybit_client, get_credentials, has_credentials
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/positions", tags=["Positions"])
 
 
+def _format_positions(positions: List[Dict]) -> List[Dict]:
+    """Открытые позиции из ответа Bybit /v5/position/list -> список dict ответа"""
+    formatted_positions = []
+    for pos in positions:
+        size = float(pos.get('size', 0))
+        # Пропускаем закрытые позиции (size = 0)
+        if size > 0:
+            formatted_positions.append({
+                "symbol": pos.get('symbol'),
+                "side": pos.get('side'),
+                "size": size,
+                "entry_price": float(pos.get('entryPrice', 0)),
+                "mark_price": float(pos.get('markPrice', 0)),
+                "pnl": float(pos.get('unrealisedPnl', 0)),
+                "pnl_percent": float(pos.get('unrealisedPnlPct', 0)) * 100,
+                "leverage": float(pos.get('leverage', 1)),
+                "position_id": pos.get('positionIdx'),
+            })
+    return formatted_positions
+
+
 @router.get("/")
-async def get_positions(db: Session = Depends(get_db)) -> Dict:
+async def get_positions(db: AsyncSession = Depends(get_async_db)) -> Dict:
     """Получить открытые позиции"""
     try:
-        exchange = db.query(ExchangeAPI).filter(
-            ExchangeAPI.exchange == "bybit"
-        ).first()
+        exchange = (await db.execute(
+            select(*CREDENTIAL_COLUMNS).where(ExchangeAPI.exchange == "bybit")
+        )).one_or_none()
+        # Соединение возвращается в пул до запроса к Bybit, а не после ответа
+        await db.close()
         
-        if not exchange:
+        if not has_credentials(exchange):
             return {
                 "status": "error",
                 "message": "API ключи не добавлены",
@@ -37,34 +60,16 @@ async def get_positions(db: Session = Depends(get_db)) -> Dict:
             }
         
         try:
-            encryptor = get_encryption_manager()
-            api_key = encryptor.decrypt(exchange.api_key_encrypted)
-            api_secret = encryptor.decrypt(exchange.api_secret_encrypted)
+            api_key, api_secret = get_credentials(exchange)
             
             client = get_bybit_client(api_key, api_secret, exchange.testnet)
             
             # Получаем открытые позиции
-            result = client.client.get_positions(category="linear")
+            result = await client.get_positions_raw()
             
             if result and result.get('retCode') == 0:
                 positions = result.get('result', {}).get('list', [])
-                
-                formatted_positions = []
-                for pos in positions:
-                    size = float(pos.get('size', 0))
-                    # Пропускаем закрытые позиции (size = 0)
-                    if size > 0:
-                        formatted_positions.append({
-                            "symbol": pos.get('symbol'),
-                            "side": pos.get('side'),
-                            "size": size,
-                            "entry_price": float(pos.get('entryPrice', 0)),
-                            "mark_price": float(pos.get('markPrice', 0)),
-                            "pnl": float(pos.get('unrealisedPnl', 0)),
-                            "pnl_percent": float(pos.get('unrealisedPnlPct', 0)) * 100,
-                            "leverage": float(pos.get('leverage', 1)),
-                            "position_id": pos.get('positionIdx'),
-                        })
+                formatted_positions = _format_positions(positions)
                 
                 logger.info(f"✅ Retrieved {len(formatted_positions)} open positions")
                 
@@ -96,26 +101,26 @@ async def get_positions(db: Session = Depends(get_db)) -> Dict:
 
 
 @router.get("/open")
-async def get_open_positions_count(db: Session = Depends(get_db)) -> Dict:
+async def get_open_positions_count(db: AsyncSession = Depends(get_async_db)) -> Dict:
     """Получить количество открытых позиций"""
     try:
-        exchange = db.query(ExchangeAPI).filter(
-            ExchangeAPI.exchange == "bybit"
-        ).first()
+        exchange = (await db.execute(
+            select(*CREDENTIAL_COLUMNS).where(ExchangeAPI.exchange == "bybit")
+        )).one_or_none()
+        # Соединение возвращается в пул до запроса к Bybit, а не после ответа
+        await db.close()
         
-        if not exchange:
+        if not has_credentials(exchange):
             return {
                 "status": "success",
                 "open_positions": 0,
             }
         
         try:
-            encryptor = get_encryption_manager()
-            api_key = encryptor.decrypt(exchange.api_key_encrypted)
-            api_secret = encryptor.decrypt(exchange.api_secret_encrypted)
+            api_key, api_secret = get_credentials(exchange)
             
             client = get_bybit_client(api_key, api_secret, exchange.testnet)
-            result = client.client.get_positions(category="linear")
+            result = await client.get_positions_raw()
             
             if result and result.get('retCode') == 0:
                 positions = result.get('result', {}).get('list', [])
@@ -140,3 +145,62 @@ async def get_open_positions_count(db: Session = Depends(get_db)) -> Dict:
             "status": "error",
             "open_positions": 0,
         }
+
+
+@router.get("/full")
+async def get_positions_full(db: AsyncSession = Depends(get_async_db)) -> Dict:
+    """
+    Позиции и количество открытых одним запросом
+    
+    Заменяет пару запросов "/" + "/open" с дашборда: один HTTP запрос,
+    один ответ Bybit (get_positions_raw)
+    """
+    try:
+        exchange = (await db.execute(
+            select(*CREDENTIAL_COLUMNS).where(ExchangeAPI.exchange == "bybit")
+        )).one_or_none()
+        # Соединение возвращается в пул до запроса к Bybit, а не после ответа
+        await db.close()
+        
+        if not has_credentials(exchange):
+            return {
+                "status": "error",
+                "message": "API ключи не добавлены",
+                "positions": [],
+                "total": 0,
+                "open_positions": 0,
+            }
+        
+        try:
+            api_key, api_secret = get_credentials(exchange)
+            
+            client = get_bybit_client(api_key, api_secret, exchange.testnet)
+            result = await client.get_positions_raw()
+            
+            if result and result.get('retCode') == 0:
+                positions = result.get('result', {}).get('list', [])
+                formatted_positions = _format_positions(positions)
+            else:
+                logger.warning(f"Empty positions response: {result}")
+                formatted_positions = []
+            
+            return {
+                "status": "success",
+                "positions": formatted_positions,
+                "total": len(formatted_positions),
+                "open_positions": len(formatted_positions),
+            }
+        
+        except Exception as e:
+            logger.error(f"Failed to get positions: {e}", exc_info=True)
+            return {
+                "status": "error",
+                "message": f"Ошибка получения позиций: {str(e)}",
+                "positions": [],
+                "total": 0,
+                "open_positions": 0,
+            }
+    
+    except Exception as e:
+        logger.error(f"Error in full positions endpoint: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
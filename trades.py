@@ -6,84 +6,302 @@ routes/trades.py - API endpoints для истории сделок (FIXED v1.1)
 Назначение: Endpoints для получения истории сделок и статистики
 """
 
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import and_, bindparam, case, func, literal_column, or_, select, union_all
 from sqlalchemy.orm import Session
 import logging
-from typing import Dict
+import orjson
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
 
-from database import get_db
+from database import get_db, get_db_session
 from models import ExchangeAPI, Trade
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/trades", tags=["Trades"])
 
+# Страницы больше этого limit отдаются потоком (StreamingResponse)
+_STREAM_MIN_LIMIT = 200
+# Строк из БД за одну порцию потока
+_STREAM_BATCH = 200
+
+
+# ===================== STATEMENTS =====================
+# Запросы собираются один раз при импорте, значения приходят через
+# bindparam - на запрос не строится заново дерево выражений, а
+# скомпилированный SQL берётся из кэша SQLAlchemy
+
+# Название биржи (проверка существования без ключей)
+_EXCHANGE_NAME = select(ExchangeAPI.exchange).where(
+    ExchangeAPI.id == bindparam("exchange_id")
+)
+
+# Отдаваемые колонки сделки (без ORM объектов)
+_TRADE_COLUMNS = (
+    Trade.id,
+    Trade.symbol,
+    Trade.side,
+    Trade.size,
+    Trade.entry_price,
+    Trade.exit_price,
+    Trade.pnl,
+    Trade.pnl_percent,
+    Trade.commission,
+    Trade.net_pnl,
+    Trade.opened_at,
+    Trade.closed_at,
+    Trade.duration_seconds,
+    Trade.status,
+    Trade.close_reason,
+)
+
+# Порядок страницы: (closed_at DESC, id DESC), сделки без closed_at - после
+# всех датированных. Каждая часть - отдельный seek по (exchange_id, closed_at):
+# условие "closed_at < ? OR closed_at IS NULL" в одном запросе не даёт SQLite
+# использовать диапазон closed_at, и каждая страница читала бы весь префикс
+# биржи. leg_limit = limit + 1 + offset строк с каждой части
+_DATED = select(*_TRADE_COLUMNS, literal_column("0").label("leg")).where(
+    Trade.exchange_id == bindparam("exchange_id"),
+    Trade.closed_at.isnot(None),
+).order_by(
+    Trade.closed_at.desc(), Trade.id.desc()
+).limit(bindparam("leg_limit"))
+
+_UNDATED = select(*_TRADE_COLUMNS, literal_column("1").label("leg")).where(
+    Trade.exchange_id == bindparam("exchange_id"),
+    Trade.closed_at.is_(None),
+).order_by(
+    Trade.id.desc()
+).limit(bindparam("leg_limit"))
+
+# Фильтры и keyset курсор (строки "после" курсора). Курсор с closed_at
+# ограничивает только датированную часть, хвост без closed_at идёт целиком;
+# курсор только с before_id - позиция внутри хвоста
+_BY_SYMBOL = Trade.symbol == bindparam("symbol")
+_BY_STATUS = Trade.status == bindparam("status")
+_BEFORE_CLOSED_AT = Trade.closed_at < bindparam("before_closed_at")
+# closed_at <= ? дублирует OR, чтобы SQLite взял его как границу диапазона
+_BEFORE_CURSOR = and_(
+    Trade.closed_at <= bindparam("before_closed_at"),
+    or_(
+        Trade.closed_at < bindparam("before_closed_at"),
+        and_(Trade.closed_at == bindparam("before_closed_at"), Trade.id < bindparam("before_id")),
+    ),
+)
+_BEFORE_ID = Trade.id < bindparam("before_id")
+
+
+def _trades_page(dated, undated):
+    """
+    Страница из частей (None - часть пропускается): UNION ALL двух seek,
+    сортировка не более 2 * leg_limit строк. limit + 1 строка вместо
+    отдельного COUNT(*): лишняя строка означает, что есть следующая страница
+    """
+    legs = [leg for leg in (dated, undated) if leg is not None]
+    if len(legs) == 1:
+        page = legs[0].subquery()
+    else:
+        page = union_all(*(select(leg.subquery()) for leg in legs)).subquery()
+    return select(*(page.c[column.key] for column in _TRADE_COLUMNS)).order_by(
+        page.c.leg, page.c.closed_at.desc(), page.c.id.desc()
+    ).limit(bindparam("limit")).offset(bindparam("offset"))
+
+
+# Страница без фильтров и курсора
+_TRADES_PAGE = _trades_page(_DATED, _UNDATED)
+
+# Статистика считается в БД - в Python приходят только агрегаты
+_net_pnl = func.coalesce(Trade.net_pnl, 0)
+_TRADE_STATS = select(
+    func.count(Trade.id),
+    func.coalesce(func.sum(_net_pnl), 0),
+    func.coalesce(func.sum(case((_net_pnl > 0, 1), else_=0)), 0),
+    func.coalesce(func.sum(case((_net_pnl > 0, _net_pnl), else_=0)), 0),
+    func.coalesce(func.sum(case((_net_pnl < 0, 1), else_=0)), 0),
+    func.coalesce(func.sum(case((_net_pnl < 0, _net_pnl), else_=0)), 0),
+).where(Trade.exchange_id == bindparam("exchange_id"))
+
+
+# ===================== HELPERS =====================
+
+def _format_trades(rows: List[Any]) -> List[Dict[str, Any]]:
+    """Строки _TRADES_PAGE -> список dict ответа"""
+    # Строка распаковывается один раз - без повторного доступа к атрибутам
+    return [
+        {
+            "id": id_,
+            "symbol": symbol_,
+            "side": side,
+            "size": float(size),
+            "entry_price": float(entry_price) if entry_price else 0,
+            "exit_price": float(exit_price) if exit_price else 0,
+            "pnl": float(pnl) if pnl else 0,
+            "pnl_percent": float(pnl_percent) if pnl_percent else 0,
+            "commission": float(commission) if commission else 0,
+            "net_pnl": float(net_pnl) if net_pnl else 0,
+            "opened_at": opened_at,
+            "closed_at": closed_at,
+            "duration_seconds": duration_seconds,
+            "status": status_,
+            "close_reason": close_reason,
+        }
+        for (
+            id_, symbol_, side, size, entry_price, exit_price, pnl, pnl_percent,
+            commission, net_pnl, opened_at, closed_at, duration_seconds,
+            status_, close_reason,
+        ) in rows
+    ]
+
+
+def _stream_trades(stmt, params: Dict[str, Any], exchange: str, limit: int, offset: int) -> Iterator[bytes]:
+    """
+    JSON ответа get_trades по частям: строки уходят клиенту порциями по
+    _STREAM_BATCH по мере чтения из БД, в памяти только одна порция
+    
+    Своя сессия: генератор дочитывает результат уже после выхода из route
+    """
+    db = get_db_session()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=_STREAM_BATCH), params)
+        
+        # {"status", "exchange", "trades": [ ... - без закрывающей скобки
+        yield orjson.dumps({"status": "success", "exchange": exchange})[:-1] + b',"trades":['
+        
+        seen = 0
+        last = None
+        for rows in result.partitions():
+            # Строка limit + 1 только сигнализирует has_more
+            page_rows = rows[:max(limit - seen, 0)]
+            if page_rows:
+                chunk = b",".join(orjson.dumps(trade) for trade in _format_trades(page_rows))
+                yield (b"," + chunk) if last is not None else chunk
+                last = page_rows[-1]
+            seen += len(rows)
+        
+        has_more = seen > limit
+        logger.info(f"✅ Streamed {min(seen, limit)} trades")
+        
+        # ... ], "has_more", "limit", "offset", "next_cursor"}
+        yield b"]," + orjson.dumps({
+            "has_more": has_more,
+            "limit": limit,
+            "offset": offset,
+            "next_cursor": {
+                "before_closed_at": last.closed_at,
+                "before_id": last.id,
+            } if has_more else None,
+        })[1:]
+    
+    except Exception as e:
+        # Заголовки уже отправлены - HTTPException не поможет, обрываем поток
+        logger.error(f"Error streaming trades: {e}")
+        raise
+    finally:
+        db.close()
+
+
+# ===================== ENDPOINTS =====================
+
 
 @router.get("")
-async def get_trades(
+def get_trades(
     exchange_id: int = Query(1, description="ID биржи"),
     limit: int = Query(100, ge=1, le=1000),
     offset: int = Query(0, ge=0),
     symbol: str = Query(None, description="Фильтр по символу"),
     status: str = Query(None, description="Фильтр по статусу"),
+    before_closed_at: Optional[datetime] = Query(None, description="Курсор: closed_at последней сделки"),
+    before_id: Optional[int] = Query(None, description="Курсор: id последней сделки"),
     db: Session = Depends(get_db)
-) -> Dict:
-    """Получить историю сделок"""
+) -> Response:
+    """
+    Получить историю сделок
+    
+    Пагинация по курсору (before_closed_at, before_id) из next_cursor -
+    seek по индексу (exchange_id, closed_at), глубина страницы не влияет
+    на время. Сделки без closed_at идут после всех датированных; если
+    последняя сделка страницы без closed_at, в курсоре before_closed_at =
+    null: передаётся только before_id. offset оставлен для совместимости
+    
+    При limit > _STREAM_MIN_LIMIT ответ отдаётся потоком - первые строки
+    уходят клиенту, не дожидаясь всей страницы
+    """
     try:
-        # Проверяем что биржа существует
-        exchange = db.query(ExchangeAPI).filter(
-            ExchangeAPI.id == exchange_id
-        ).first()
+        # Проверяем что биржа существует (только название, без ключей)
+        exchange = db.execute(_EXCHANGE_NAME, {"exchange_id": exchange_id}).scalar()
         
-        if not exchange:
+        if exchange is None:
             raise HTTPException(
                 status_code=404,
                 detail=f"Exchange {exchange_id} not found"
             )
         
-        # Строим запрос
-        query = db.query(Trade).filter(Trade.exchange_id == exchange_id)
+        params = {
+            "exchange_id": exchange_id,
+            "limit": limit + 1,
+            "offset": offset,
+            "leg_limit": limit + 1 + offset,
+        }
+        
+        # Без фильтров и курсора запрос выполняется как есть
+        if symbol or status or before_closed_at is not None or before_id is not None:
+            dated, undated = _DATED, _UNDATED
+            
+            # Фильтры
+            if symbol:
+                dated, undated = dated.where(_BY_SYMBOL), undated.where(_BY_SYMBOL)
+                params["symbol"] = symbol
+            if status:
+                dated, undated = dated.where(_BY_STATUS), undated.where(_BY_STATUS)
+                params["status"] = status
+            
+            # Keyset пагинация
+            if before_closed_at is not None:
+                params["before_closed_at"] = before_closed_at
+                if before_id is not None:
+                    dated = dated.where(_BEFORE_CURSOR)
+                    params["before_id"] = before_id
+                else:
+                    dated = dated.where(_BEFORE_CLOSED_AT)
+            elif before_id is not None:
+                # Курсор внутри хвоста без closed_at
+                dated, undated = None, undated.where(_BEFORE_ID)
+                params["before_id"] = before_id
+            
+            stmt = _trades_page(dated, undated)
+        else:
+            stmt = _TRADES_PAGE
         
-        # Фильтры
-        if symbol:
-            query = query.filter(Trade.symbol == symbol)
-        if status:
-            query = query.filter(Trade.status == status)
+        # Большие страницы - потоком
+        if limit > _STREAM_MIN_LIMIT:
+            return StreamingResponse(
+                _stream_trades(stmt, params, exchange, limit, offset),
+                media_type="application/json",
+            )
         
         # Получаем сделки
-        total = query.count()
-        trades = query.order_by(Trade.closed_at.desc()).limit(limit).offset(offset).all()
-        
-        formatted_trades = [
-            {
-                "id": t.id,
-                "symbol": t.symbol,
-                "side": t.side,
-                "size": float(t.size),
-                "entry_price": float(t.entry_price) if t.entry_price else 0,
-                "exit_price": float(t.exit_price) if t.exit_price else 0,
-                "pnl": float(t.pnl) if t.pnl else 0,
-                "pnl_percent": float(t.pnl_percent) if t.pnl_percent else 0,
-                "commission": float(t.commission) if t.commission else 0,
-                "net_pnl": float(t.net_pnl) if t.net_pnl else 0,
-                "opened_at": t.opened_at.isoformat() if t.opened_at else None,
-                "closed_at": t.closed_at.isoformat() if t.closed_at else None,
-                "duration_seconds": t.duration_seconds,
-                "status": t.status,
-                "close_reason": t.close_reason,
-            }
-            for t in trades
-        ]
+        trades = db.execute(stmt, params).all()
+        
+        has_more = len(trades) > limit
+        trades = trades[:limit]
+        formatted_trades = _format_trades(trades)
         
         logger.info(f"✅ Retrieved {len(formatted_trades)} trades")
         
-        return {
+        # datetime сериализует orjson (ISO 8601), без jsonable_encoder
+        return ORJSONResponse({
             "status": "success",
-            "exchange": exchange.exchange,
+            "exchange": exchange,
             "trades": formatted_trades,
-            "total": total,
+            "has_more": has_more,
             "limit": limit,
             "offset": offset,
-        }
+            "next_cursor": {
+                "before_closed_at": trades[-1].closed_at,
+                "before_id": trades[-1].id,
+            } if has_more else None,
+        })
     
     except HTTPException:
         raise
@@ -96,30 +314,34 @@ async def get_trades(
 
 
 @router.get("/stats")
-async def get_trade_stats(
+def get_trade_stats(
     exchange_id: int = Query(1, description="ID биржи"),
     db: Session = Depends(get_db)
 ) -> Dict:
     """Получить статистику по сделкам"""
     try:
-        # Проверяем что биржа существует
-        exchange = db.query(ExchangeAPI).filter(
-            ExchangeAPI.id == exchange_id
-        ).first()
+        # Проверяем что биржа существует (только название, без ключей)
+        exchange = db.execute(_EXCHANGE_NAME, {"exchange_id": exchange_id}).scalar()
         
-        if not exchange:
+        if exchange is None:
             raise HTTPException(
                 status_code=404,
                 detail=f"Exchange {exchange_id} not found"
             )
         
-        # Получаем все сделки
-        trades = db.query(Trade).filter(Trade.exchange_id == exchange_id).all()
+        (
+            total_trades,
+            total_pnl,
+            winning_count,
+            winning_sum,
+            losing_count,
+            losing_sum,
+        ) = db.execute(_TRADE_STATS, {"exchange_id": exchange_id}).one()
         
-        if not trades:
+        if not total_trades:
             return {
                 "status": "success",
-                "exchange": exchange.exchange,
+                "exchange": exchange,
                 "stats": {
                     "total_trades": 0,
                     "winning_trades": 0,
@@ -132,26 +354,22 @@ async def get_trade_stats(
                 }
             }
         
-        # Рассчитываем статистику
-        total_pnl = sum(float(t.net_pnl or 0) for t in trades)
-        winning_trades = [t for t in trades if float(t.net_pnl or 0) > 0]
-        losing_trades = [t for t in trades if float(t.net_pnl or 0) < 0]
-        
-        win_rate = (len(winning_trades) / len(trades) * 100) if trades else 0
-        avg_win = (sum(float(t.net_pnl or 0) for t in winning_trades) / len(winning_trades)) if winning_trades else 0
-        avg_loss = (sum(float(t.net_pnl or 0) for t in losing_trades) / len(losing_trades)) if losing_trades else 0
-        profit_factor = (abs(sum(float(t.net_pnl or 0) for t in winning_trades)) / abs(sum(float(t.net_pnl or 0) for t in losing_trades))) if losing_trades and sum(float(t.net_pnl or 0) for t in losing_trades) != 0 else 0
+        # Рассчитываем статистику из агрегатов
+        win_rate = winning_count / total_trades * 100
+        avg_win = (winning_sum / winning_count) if winning_count else 0
+        avg_loss = (losing_sum / losing_count) if losing_count else 0
+        profit_factor = (abs(winning_sum) / abs(losing_sum)) if losing_count and losing_sum != 0 else 0
         
-        logger.info(f"✅ Calculated stats for {len(trades)} trades")
+        logger.info(f"✅ Calculated stats for {total_trades} trades")
         
         return {
             "status": "success",
-            "exchange": exchange.exchange,
+            "exchange": exchange,
             "stats": {
-                "total_trades": len(trades),
-                "winning_trades": len(winning_trades),
-                "losing_trades": len(losing_trades),
-                "total_pnl": round(total_pnl, 2),
+                "total_trades": total_trades,
+                "winning_trades": winning_count,
+                "losing_trades": losing_count,
+                "total_pnl": round(float(total_pnl), 2),
                 "win_rate": round(win_rate, 2),
                 "avg_win": round(avg_win, 2),
                 "avg_loss": round(avg_loss, 2),
@@ -1,46 +1,212 @@
+import base64
+import binascii
+import hashlib
 import os
-from cryptography.fernet import Fernet
+import threading
+from collections import OrderedDict
+from hmac import compare_digest
+from typing import Optional, Union
+from cryptography.exceptions import InvalidSignature, InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes, hmac, padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 import logging
 
 logger = logging.getLogger(__name__)
 
 _encryption_manager = None
 
+# Максимум расшифрованных значений в кэше EncryptionManager
+_DECRYPT_CACHE_SIZE = 1024
+
+# Формат токена Fernet: version(1) | timestamp(8) | IV(16) | ciphertext | HMAC(32)
+_FERNET_VERSION = b"\x80"
+_HMAC_SIZE = 32
+
+# Формат v2: version(1) | IV(16) | ciphertext | blake2b MAC(16)
+_V2_VERSION = b"\x81"
+_V2_MAC_SIZE = 16
+
+# Формат v3: version(1) | nonce(12) | AES-256-GCM ciphertext | tag(16)
+_V3_VERSION = b"\x82"
+_V3_NONCE_SIZE = 12
+_V3_TAG_SIZE = 16
+_V3_KDF_INFO = b"slezun encryption v3 aes-gcm"
+
 class EncryptionManager:
+    """
+    Шифрование значений в БД (ключ в формате Fernet)
+    
+    Новые значения пишутся токенами v3 (0x82): AES-256-GCM - один проход
+    по данным (AES-NI + PCLMULQDQ в OpenSSL) вместо CBC + отдельного MAC.
+    Ключ GCM выводится из ключа Fernet через HKDF. Токены v2 (0x81,
+    AES-CBC + blake2b) и Fernet (0x80), уже лежащие в БД, по-прежнему
+    расшифровываются
+    """
+    
     def __init__(self, key: str = None):
         if key:
             # Используем ключ из переменной окружения
-            self.cipher = Fernet(key.encode() if isinstance(key, str) else key)
+            key = key.encode() if isinstance(key, str) else key
         else:
             # Генерируем новый (ВРЕМЕННЫЙ)
-            self.cipher = Fernet(Fernet.generate_key())
+            key = Fernet.generate_key()
             logger.warning("⚠️  Generated new encryption key - not recommended for production!")
+        
+        try:
+            raw_key = base64.urlsafe_b64decode(key)
+        except binascii.Error as exc:
+            raise ValueError("Fernet key must be 32 url-safe base64-encoded bytes.") from exc
+        if len(raw_key) != 32:
+            raise ValueError("Fernet key must be 32 url-safe base64-encoded bytes.")
+        
+        # Первые 16 байт - ключ подписи, остальные - ключ AES
+        self._sig_key = raw_key[:16]
+        self._hmac = hmac.HMAC(self._sig_key, hashes.SHA256())
+        self._aes = algorithms.AES(raw_key[16:])
+        self._gcm = AESGCM(HKDF(
+            algorithm=hashes.SHA256(), length=32, salt=None, info=_V3_KDF_INFO,
+        ).derive(raw_key))
+        
+        # LRU кэш: шифротекст -> расшифрованная строка (живёт вместе с ключом)
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_lock = threading.Lock()
     
-    def encrypt(self, data: str) -> str:
-        """Шифрует строку"""
-        return self.cipher.encrypt(data.encode()).decode()
+    def encrypt(self, data: Union[str, bytes]) -> str:
+        """Шифрует строку (или уже закодированные байты)"""
+        if isinstance(data, str):
+            data = data.encode()
+        nonce = os.urandom(_V3_NONCE_SIZE)
+        # Байт версии - associated data: его подмена ломает тег
+        ciphertext = self._gcm.encrypt(nonce, data, _V3_VERSION)
+        # base64 всегда ASCII
+        return base64.urlsafe_b64encode(_V3_VERSION + nonce + ciphertext).decode("ascii")
     
-    def decrypt(self, encrypted_data: str) -> str:
-        """Расшифровывает строку"""
+    def _v2_mac(self, data: bytes) -> bytes:
+        """MAC токена v2: keyed blake2b от version | IV | ciphertext"""
+        return hashlib.blake2b(data, key=self._sig_key, digest_size=_V2_MAC_SIZE).digest()
+    
+    def _cbc_decrypt(self, iv: bytes, ciphertext: bytes) -> bytes:
+        """AES-CBC расшифровка + снятие PKCS7 (MAC уже проверен)"""
+        decryptor = Cipher(self._aes, modes.CBC(iv)).decryptor()
+        padded = decryptor.update(ciphertext)
+        try:
+            padded += decryptor.finalize()
+            unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+            return unpadder.update(padded) + unpadder.finalize()
+        except ValueError:
+            raise InvalidToken
+    
+    def _decrypt_token(self, token: Union[str, bytes]) -> bytes:
+        """Проверить MAC/тег токена (v3, v2 или Fernet) и расшифровать, без проверки TTL"""
+        try:
+            # b64decode принимает ASCII str напрямую; не-ASCII - ValueError
+            data = base64.urlsafe_b64decode(token)
+        except (TypeError, ValueError):
+            raise InvalidToken
+        
+        version = data[:1]
+        if version == _V3_VERSION:
+            if len(data) < 1 + _V3_NONCE_SIZE + _V3_TAG_SIZE:
+                raise InvalidToken
+            try:
+                return self._gcm.decrypt(data[1:1 + _V3_NONCE_SIZE], data[1 + _V3_NONCE_SIZE:], _V3_VERSION)
+            except InvalidTag:
+                raise InvalidToken
+        
+        if version == _V2_VERSION:
+            if len(data) < 1 + 16 + _V2_MAC_SIZE:
+                raise InvalidToken
+            if not compare_digest(self._v2_mac(data[:-_V2_MAC_SIZE]), data[-_V2_MAC_SIZE:]):
+                raise InvalidToken
+            return self._cbc_decrypt(data[1:17], data[17:-_V2_MAC_SIZE])
+        
+        if version != _FERNET_VERSION or len(data) < 1 + 8 + 16 + _HMAC_SIZE:
+            raise InvalidToken
+        
+        h = self._hmac.copy()
+        h.update(data[:-_HMAC_SIZE])
         try:
-            return self.cipher.decrypt(encrypted_data.encode()).decode()
-        except Exception as e:
-            logger.error(f"Failed to decrypt data: {e}")
-            raise
+            h.verify(data[-_HMAC_SIZE:])
+        except InvalidSignature:
+            raise InvalidToken
+        return self._cbc_decrypt(data[9:25], data[25:-_HMAC_SIZE])
+    
+    def decrypt(self, encrypted_data: str) -> str:
+        """Расшифровывает строку (пустой шифротекст - ValueError без MAC проверки)"""
+        if not encrypted_data:
+            raise ValueError("empty ciphertext")
+        
+        with self._cache_lock:
+            cached = self._cache.get(encrypted_data)
+            if cached is not None:
+                self._cache.move_to_end(encrypted_data)
+                return cached
+        
+        # InvalidToken пробрасывается как есть - логируют вызывающие routes
+        decrypted = self._decrypt_token(encrypted_data).decode()
+        
+        with self._cache_lock:
+            self._cache[encrypted_data] = decrypted
+            if len(self._cache) > _DECRYPT_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return decrypted
+    
+    def clear_cache(self) -> None:
+        """Сбросить кэш расшифрованных значений (удаление/ротация ключей)"""
+        with self._cache_lock:
+            self._cache.clear()
 
-def get_encryption_manager() -> EncryptionManager:
-    """Получить менеджер шифрования"""
+def log_crypto_backend() -> None:
+    """Залогировать OpenSSL, с которым собран cryptography, и аппаратное ускорение AES/SHA"""
+    try:
+        from cryptography.hazmat.backends.openssl.backend import backend
+        logger.info(f"🔐 Crypto backend: {backend.openssl_version_text()}")
+    except Exception as e:
+        logger.warning(f"⚠️  Could not detect OpenSSL version: {e}")
+    
+    # Флаги CPU есть только в Linux /proc/cpuinfo (x86: flags, ARM: Features)
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = set()
+            for line in f:
+                if line.startswith(("flags", "Features")):
+                    flags.update(line.split(":", 1)[1].split())
+    except OSError:
+        return
+    
+    has_aes = "aes" in flags
+    has_sha = bool(flags & {"sha_ni", "sha2"})
+    if has_aes:
+        logger.info(f"✅ CPU AES acceleration available (SHA: {has_sha})")
+    else:
+        logger.warning("⚠️  CPU has no AES instructions - AES-GCM encrypt/decrypt will be slow")
+
+
+def init_encryption_manager(encryption_key: Optional[str] = None) -> EncryptionManager:
+    """
+    Создать глобальный менеджер шифрования (вызывается при старте приложения)
+    
+    Args:
+        encryption_key: Ключ Fernet (из ENCRYPTION_KEY); без него - временный
+    """
     global _encryption_manager
     
-    if _encryption_manager is None:
-        # Пытаемся получить ключ из .env
-        encryption_key = os.getenv("ENCRYPTION_KEY")
-        
-        if encryption_key:
-            logger.info("✅ Using encryption key from .env")
-            _encryption_manager = EncryptionManager(encryption_key)
-        else:
-            logger.warning("⚠️  No ENCRYPTION_KEY in .env, using temporary key")
-            _encryption_manager = EncryptionManager()
+    if encryption_key:
+        logger.info("✅ Using encryption key from .env")
+        _encryption_manager = EncryptionManager(encryption_key)
+    else:
+        logger.warning("⚠️  No ENCRYPTION_KEY in .env, using temporary key")
+        _encryption_manager = EncryptionManager()
     
     return _encryption_manager
+
+
+def get_encryption_manager() -> EncryptionManager:
+    """Получить менеджер шифрования (созданный init_encryption_manager)"""
+    # assert пропадает при python -O - явная ошибка вместо None
+    if _encryption_manager is None:
+        raise RuntimeError("EncryptionManager не инициализирован")
+    return _encryption_manager